@@ -16,9 +16,11 @@ This script supports the following query params supported by Bark: icon, sound,
 from __future__ import annotations
 
 import argparse
+import functools
+import json
 import os
 import sys
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, urlencode
 
 import requests
 
@@ -31,27 +33,36 @@ except Exception:
     pass
 
 
+# reuse one connection pool (DNS, TCP and TLS setup) across sends
+_SESSION = requests.Session()
+
+# titles/bodies repeat a lot (e.g. the "Test" default), so cache their encoding
+_enc = functools.lru_cache(maxsize=1024)(quote_plus)
+
+
 def build_bark_url(device_key: str, title: str, body: str, params: dict[str, str] | None = None) -> str:
-    title_q = quote_plus(title or "")
-    body_q = quote_plus(body or "")
-    base = f"https://api.day.app/{device_key}/{title_q}/{body_q}"
+    base = f"https://api.day.app/{device_key}/{_enc(title or '')}/{_enc(body or '')}"
     if not params:
         return base
-    # build query string for optional params
-    pairs = []
-    for k, v in params.items():
-        if v is None or v == "":
-            continue
-        pairs.append(f"{quote_plus(k)}={quote_plus(v)}")
-    if not pairs:
+    # build query string for optional params, skipping empty ones
+    query = urlencode({k: v for k, v in params.items() if v}, quote_via=quote_plus)
+    if not query:
         return base
-    return base + "?" + "&".join(pairs)
+    return base + "?" + query
+
+
+def build_bark_payload(title: str, body: str, params: dict[str, str] | None = None) -> dict[str, str]:
+    payload = {"title": title or "", "body": body or ""}
+    if params:
+        payload.update({k: v for k, v in params.items() if v})
+    return payload
 
 
 def send_bark(device_key: str, title: str, body: str, params: dict[str, str] | None = None, timeout: int = 10) -> tuple[int, str]:
-    url = build_bark_url(device_key, title, body, params)
+    # POST JSON to https://api.day.app/{key}; avoids path encoding and URL length limits
+    url = f"https://api.day.app/{device_key}"
     try:
-        r = requests.get(url, timeout=timeout)
+        r = _SESSION.post(url, json=build_bark_payload(title, body, params), timeout=timeout)
         return r.status_code, r.text
     except requests.RequestException as e:
         return 0, str(e)
@@ -66,7 +77,7 @@ def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     p.add_argument("--sound", help="Sound name (optional)")
     p.add_argument("--copy", help="Text to copy to clipboard on iPhone (optional)")
     p.add_argument("--url", help="Open URL when tapping the notification (optional)")
-    p.add_argument("--dry-run", action="store_true", help="Show the Bark URL and do not send network request")
+    p.add_argument("--dry-run", action="store_true", help="Show the Bark request and do not send network request")
     p.add_argument("--timeout", type=int, default=10, help="HTTP timeout in seconds")
     return p.parse_args(argv)
 
@@ -89,10 +100,10 @@ def main(argv: list[str] | None = None) -> int:
     if args.url:
         params["url"] = args.url
 
-    url = build_bark_url(device_key, args.title, args.body, params)
-
     if args.dry_run:
-        print("Dry run - Bark URL:\n", url)
+        print("Dry run - Bark POST to:", f"https://api.day.app/{device_key}")
+        print("JSON payload:", json.dumps(build_bark_payload(args.title, args.body, params), ensure_ascii=False))
+        print("Equivalent GET URL:\n", build_bark_url(device_key, args.title, args.body, params))
         print("To actually send, re-run without --dry-run or pass a real device key.")
         return 0
 
@@ -14,22 +14,42 @@ Notes:
 """
 
 import argparse
-import csv
-import io
-import json
+import asyncio
+import logging
 import os
-import subprocess
 import sys
 import time
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional, List, Tuple
-import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple
+import httpx
+import orjson
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the state-file lock is skipped there
+    fcntl = None
+
 
 STATE_DEFAULT = "kaggle_monitor_state.json"
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36"
+HTTP_TIMEOUT = httpx.Timeout(10)
+KAGGLE_KERNELS_LIST_URL = "https://www.kaggle.com/api/v1/kernels/list"
+# Upper bound on simultaneous Kaggle API requests when monitoring several competitions
+KAGGLE_CONCURRENCY = 5
+# Pending notification batches; a full queue makes the fetcher wait for the notifier
+NOTIFY_QUEUE_SIZE = 100
+# Upper bound in seconds on delivering queued notifications at shutdown
+NOTIFY_DRAIN_TIMEOUT = 10
+# Quiet polls double the interval up to this multiple of --interval
+MAX_BACKOFF_FACTOR = 8
+
+_kaggle_auth: Optional[httpx.BasicAuth] = None
+
+log = logging.getLogger("monitor")
 
 
 @dataclass
@@ -40,130 +60,380 @@ class NotebookInfo:
     url: str
 
 
+class RateLimited(Exception):
+    """Raised when Kaggle or Bark answers 429/5xx; the caller should wait retry_after seconds."""
+
+    def __init__(self, status: int, retry_after: float):
+        super().__init__(f"HTTP {status}, retry after {retry_after:g}s")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str], default: float) -> float:
+    # Retry-After is either delta-seconds or an HTTP-date
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_backoff_status(status: Optional[int]) -> bool:
+    return status is not None and (status == 429 or status >= 500)
+
+
 def parse_args():
     p = argparse.ArgumentParser()
-    p.add_argument("--competition", required=True, help="Kaggle competition slug (e.g. hull-tactical-market-prediction)")
+    p.add_argument("--competition", required=True, nargs="+",
+                   help="One or more Kaggle competition slugs (e.g. hull-tactical-market-prediction)")
     p.add_argument("--bark", help="Bark key or full URL (e.g. https://api.day.app/<key>/)")
-    p.add_argument("--interval", type=int, default=300, help="Polling interval in seconds (default 300)")
+    p.add_argument("--interval", type=int, default=300, help="Base polling interval in seconds (default 300); backs off up to 8x while nothing changes")
     p.add_argument("--state", default=STATE_DEFAULT, help="Path to JSON state file")
     p.add_argument("--once", action="store_true", help="Run once and exit (don't monitor continuously)")
+    p.add_argument("--verbose", "-v", action="store_true", help="Log per-poll status messages (INFO level)")
     return p.parse_args()
 
 
 def load_state(path: str) -> dict:
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
+    try:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except Exception:
+        # Missing, unreadable or corrupt: start from empty state
+        return {}
 
 
 def save_state(path: str, data: dict):
     tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     os.replace(tmp, path)
 
 
-def get_notebooks(competition: str) -> List[NotebookInfo]:
-    result = subprocess.run(
-        ['kaggle', 'kernels', 'list', '--competition', competition, '--sort-by', 'scoreDescending', '--page-size', '3','--csv'],
-        capture_output=True, text=True, encoding='utf-8'
-    )
-    if result.returncode != 0:
-        print("Error running kaggle CLI:", result.stderr)
-        return []
-
-    reader = csv.DictReader(io.StringIO(result.stdout))
-    notebooks = []
-    for row in reader:
-        ref = row.get('ref', '')
-        title = row.get('title', '')
-        author = row.get('author', '')
-        url = f"https://www.kaggle.com{ref}" if ref else ""
-        # No score available in CSV
-        notebooks.append(NotebookInfo(title=title, author=author, score=None, url=url))
-    return notebooks
-
-
-def best_notebook(notebooks: List[NotebookInfo]) -> Optional[NotebookInfo]:
-    # Since no score available, consider the first (top sorted) as best
-    if notebooks:
-        return notebooks[0]
-    return None
-
-
-def send_bark(bark: str, title: str, body: str):
+def acquire_state_lock(path: str) -> Optional[int]:
+    # Advisory lock so two monitors never share a state file (and double-notify).
+    # The fd is kept open for the life of the process; the OS releases the lock on exit.
+    if fcntl is None:
+        return None
+    fd = os.open(path + ".lock", os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+class StateCache:
+    """In-memory copy of the state file; only written back when a value actually changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = load_state(path)
+        self._dirty = False
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key: str, value):
+        if key in self.data and self.data[key] == value:
+            return
+        self.data[key] = value
+        self._dirty = True
+
+    def pop(self, key: str, default=None):
+        if key not in self.data:
+            return default
+        self._dirty = True
+        return self.data.pop(key)
+
+    def flush(self):
+        if not self._dirty:
+            return
+        save_state(self.path, self.data)
+        self._dirty = False
+
+
+def get_kaggle_auth() -> httpx.BasicAuth:
+    # Same lookup order as the kaggle CLI: env vars first, then kaggle.json. Read once per process.
+    global _kaggle_auth
+    if _kaggle_auth is None:
+        username = os.getenv("KAGGLE_USERNAME")
+        key = os.getenv("KAGGLE_KEY")
+        if not (username and key):
+            config_dir = os.getenv("KAGGLE_CONFIG_DIR") or os.path.join(os.path.expanduser("~"), ".kaggle")
+            config_path = os.path.join(config_dir, "kaggle.json")
+            try:
+                with open(config_path, "rb") as f:
+                    config = orjson.loads(f.read())
+            except (OSError, orjson.JSONDecodeError) as e:
+                raise RuntimeError(f"Kaggle credentials not found: set KAGGLE_USERNAME/KAGGLE_KEY or create {config_path}") from e
+            username = config.get("username")
+            key = config.get("key")
+        _kaggle_auth = httpx.BasicAuth(username, key)
+    return _kaggle_auth
+
+
+async def get_top_notebook(client: httpx.AsyncClient, competition: str, retry_default: float = 60,
+                           etag: Optional[str] = None,
+                           cached: Optional[NotebookInfo] = None) -> Tuple[Optional[NotebookInfo], Optional[str]]:
+    # Only the top-ranked notebook is ever used, so ask for just that one
+    params = {"competition": competition, "sortBy": "scoreDescending", "pageSize": "1"}
+    # Conditional GET: a 304 means the listing is unchanged, so no body to transfer or parse
+    headers = {"If-None-Match": etag} if etag and cached is not None else None
+    try:
+        r = await client.get(KAGGLE_KERNELS_LIST_URL, params=params, headers=headers, auth=get_kaggle_auth())
+    except httpx.HTTPError as e:
+        log.error("Error fetching notebooks from Kaggle API: %s", e)
+        return None, etag
+    if r.status_code == 304 and headers:
+        return cached, etag
+    if is_backoff_status(r.status_code):
+        raise RateLimited(r.status_code, parse_retry_after(r.headers.get("Retry-After"), retry_default))
+    if r.status_code != 200:
+        log.error("Error fetching notebooks from Kaggle API: %s %s", r.status_code, r.text[:200])
+        return None, etag
+    try:
+        kernels = orjson.loads(r.content)
+    except orjson.JSONDecodeError as e:
+        log.error("Error decoding Kaggle API response: %s", e)
+        return None, etag
+
+    new_etag = r.headers.get("ETag")
+    if not isinstance(kernels, list) or not kernels:
+        return None, new_etag
+    kernel = kernels[0]
+    ref = kernel.get('ref') or ''
+    title = kernel.get('title') or ''
+    author = kernel.get('author') or ''
+    url = f"https://www.kaggle.com{ref}" if ref else ""
+    # No score available in the kernel listing
+    return NotebookInfo(title=title, author=author, score=None, url=url), new_etag
+
+
+async def send_bark(client: httpx.AsyncClient, bark: str, title: str, body: str, retry_default: float = 60,
+                    params: Optional[dict] = None):
     if not bark:
-        print("Bark key not provided; skipping notification")
+        log.warning("Bark key not provided; skipping notification")
         return
     # Accept either a full URL like https://api.day.app/<key>/ or a key string
     if bark.startswith("http"):
-        url = bark.rstrip("/") + "/"
+        url = bark.rstrip("/")
     else:
-        url = f"https://api.day.app/{bark}/"
-    # build message endpoint: https://api.day.app/{key}/{title}/{body}
-    import urllib.parse
-    path_title = urllib.parse.quote(title, safe="")
-    path_body = urllib.parse.quote(body, safe="")
-    send_url = f"{url}{path_title}/{path_body}"
+        url = f"https://api.day.app/{bark}"
+    # POST the message as JSON to https://api.day.app/{key}: no path encoding, no URL length limit
+    payload = {"title": title, "body": body, **(params or {})}
     try:
-        r = requests.get(send_url, timeout=10)
-        print("Bark response:", r.status_code, r.text[:200])
+        r = await client.post(url, json=payload)
+        level = logging.INFO if r.status_code == 200 else logging.WARNING
+        log.log(level, "Bark response: %s %s", r.status_code, r.text[:200])
     except Exception as e:
-        print("Failed to send Bark notification:", e)
+        log.error("Failed to send Bark notification: %s", e)
+        return
+    if is_backoff_status(r.status_code):
+        raise RateLimited(r.status_code, parse_retry_after(r.headers.get("Retry-After"), retry_default))
+
 
+async def monitor_one(client: httpx.AsyncClient, competition: str, state: StateCache,
+                      kaggle_limit: asyncio.Semaphore, retry_default: float = 60) -> Tuple[bool, Optional[NotebookInfo]]:
+    # State is kept per competition slug
+    entry = state.get(competition) or {}
+    cached = None
+    if entry.get("best_url"):
+        cached = NotebookInfo(title=entry.get("best_title", ""), author=entry.get("best_author", ""),
+                              score=entry.get("best_score"), url=entry["best_url"])
 
-def monitor_once(competition: str, bark: Optional[str], state_path: str) -> Tuple[bool, Optional[NotebookInfo]]:
-    print("Fetching notebooks via Kaggle API")
-    notebooks = get_notebooks(competition)
-    print(f"Found {len(notebooks)} candidate notebooks")
-    best = best_notebook(notebooks)
-    state = load_state(state_path)
-    prev_url = state.get("best_url")
+    log.info("[%s] Fetching top notebook via Kaggle API", competition)
+    async with kaggle_limit:
+        best, etag = await get_top_notebook(client, competition, retry_default, entry.get("etag"), cached)
 
     if best is None:
-        print("No notebooks found.")
+        log.info("[%s] No notebooks found.", competition)
         return False, None
 
-    print(f"Best found: {best.title} by {best.author} url={best.url}")
-
-    if prev_url is None or best.url != prev_url:
-        print(f"New top notebook: {best.title}")
-        state["best_score"] = None  # No score available
-        state["best_url"] = best.url
-        state["updated_at"] = datetime.utcnow().isoformat()
-        save_state(state_path, state)
-        # send bark
-        title = f"New Top Kaggle Notebook"
-        body = f"{best.title} by {best.author}\n{best.url}"
-        send_bark(bark or "", title, body)
-        return True, best
-
-    print("No change detected.")
-    return False, best
+    log.info("[%s] Best found: %s by %s url=%s", competition, best.title, best.author, best.url)
 
+    payload = {"best_url": best.url, "best_score": None}  # No score available
+    new_entry = {**entry, **payload, "best_title": best.title, "best_author": best.author}
+    if etag:
+        new_entry["etag"] = etag
+    else:
+        new_entry.pop("etag", None)
+    if all(entry.get(k) == v for k, v in payload.items()):
+        # Same top notebook: only persist if the cached details/ETag moved, and leave updated_at alone
+        log.info("[%s] No change detected.", competition)
+        state.set(competition, new_entry)
+        state.flush()
+        return False, best
+
+    log.info("[%s] New top notebook: %s", competition, best.title)
+    new_entry["updated_at"] = int(time.time())
+    state.set(competition, new_entry)
+    state.flush()
+    return True, best
+
+
+def format_notification(changes: List[Tuple[str, NotebookInfo]]) -> Tuple[str, str]:
+    # Every competition that changed in the same poll goes into one notification
+    if len(changes) == 1:
+        title = "New Top Kaggle Notebook"
+    else:
+        title = f"{len(changes)} New Top Kaggle Notebooks"
+    body = "\n\n".join(f"{competition}: {best.title} by {best.author}\n{best.url}" for competition, best in changes)
+    return title, body
 
-def main():
-    args = parse_args()
-    load_dotenv()
-    bark = args.bark or os.getenv("BARK_KEY")
-    state_path = args.state
 
+async def monitor_once(client: httpx.AsyncClient, competitions: List[str], state: StateCache,
+                       kaggle_limit: asyncio.Semaphore, changes_queue: "asyncio.Queue[List[Tuple[str, NotebookInfo]]]",
+                       retry_default: float = 60) -> bool:
+    results = await asyncio.gather(
+        *(monitor_one(client, c, state, kaggle_limit, retry_default) for c in competitions),
+        return_exceptions=True,
+    )
+    changes: List[Tuple[str, NotebookInfo]] = []
+    rate_limited: Optional[RateLimited] = None
+    for competition, result in zip(competitions, results):
+        if isinstance(result, RateLimited):
+            if rate_limited is None or result.retry_after > rate_limited.retry_after:
+                rate_limited = result
+        elif isinstance(result, Exception):
+            log.error("[%s] Error during monitoring: %s", competition, result)
+        elif result[0]:
+            changes.append((competition, result[1]))
+
+    if changes:
+        # Hand off to the notifier so a slow Bark push never delays the next poll
+        await changes_queue.put(changes)
+    if rate_limited is not None:
+        raise rate_limited
+    return bool(changes)
+
+
+async def notifier(client: httpx.AsyncClient, bark: Optional[str],
+                   changes_queue: "asyncio.Queue[List[Tuple[str, NotebookInfo]]]", retry_default: float = 60):
+    # Changes already saved to state but not yet delivered (kept across a Bark 429/5xx backoff)
+    pending: List[Tuple[str, NotebookInfo]] = []
+    try:
+        while True:
+            batches = 0
+            if not pending:
+                pending = list(await changes_queue.get())
+                batches = 1
+            # Anything queued while the previous push was in flight goes out in the same notification
+            while not changes_queue.empty():
+                pending += changes_queue.get_nowait()
+                batches += 1
+            # One line per competition: a newer change supersedes an undelivered older one
+            changes = list(dict(pending).items())
+            backoff = 0.0
+            try:
+                title, body = format_notification(changes)
+                # With a single change, tapping the notification opens the notebook
+                params = {"url": changes[0][1].url} if len(changes) == 1 else None
+                await send_bark(client, bark or "", title, body, retry_default, params)
+                pending = []
+            except RateLimited as e:
+                log.warning("Bark backing off: %s; retrying %d change(s) later", e, len(changes))
+                pending = changes
+                backoff = e.retry_after
+            except Exception as e:
+                log.error("Error sending notification: %s", e)
+                pending = []
+            finally:
+                # Mark batches done before any backoff so queue.join() (e.g. under --once) isn't held by the sleep
+                for _ in range(batches):
+                    changes_queue.task_done()
+            if backoff:
+                await asyncio.sleep(backoff)
+    except asyncio.CancelledError:
+        while not changes_queue.empty():
+            pending += changes_queue.get_nowait()
+        if pending:
+            undelivered = dict(pending)
+            log.warning("Shutting down with %d undelivered change(s): %s", len(undelivered), ", ".join(undelivered))
+        raise
+
+
+async def fetcher(args: argparse.Namespace, client: httpx.AsyncClient, state: StateCache,
+                  changes_queue: "asyncio.Queue[List[Tuple[str, NotebookInfo]]]"):
+    kaggle_limit = asyncio.Semaphore(KAGGLE_CONCURRENCY)
     if args.once:
-        monitor_once(args.competition, bark, state_path)
+        try:
+            await monitor_once(client, args.competition, state, kaggle_limit, changes_queue)
+        except RateLimited as e:
+            log.warning("Backing off: %s", e)
         return
 
+    current_interval = args.interval
     while True:
+        extra_wait = 0.0
         try:
-            changed, best = monitor_once(args.competition, bark, state_path)
+            changed = await monitor_once(client, args.competition, state, kaggle_limit, changes_queue, args.interval)
+            if changed:
+                current_interval = args.interval
+            else:
+                current_interval = min(current_interval * 2, args.interval * MAX_BACKOFF_FACTOR)
+        except RateLimited as e:
+            log.warning("Backing off: %s", e)
+            extra_wait = e.retry_after
         except Exception as e:
-            print("Error during monitoring:", e)
+            log.error("Error during monitoring: %s", e)
         if args.interval <= 0:
             break
-        time.sleep(args.interval)
+        await asyncio.sleep(current_interval + extra_wait)
+
+
+async def monitor_loop(args: argparse.Namespace, bark: Optional[str]):
+    state = StateCache(args.state)
+    # Older versions kept one flat entry for a single competition; move it under that slug
+    if len(args.competition) == 1 and state.get("best_url") is not None and state.get(args.competition[0]) is None:
+        state.set(args.competition[0], {k: state.pop(k) for k in ("best_url", "best_score", "updated_at") if k in state.data})
+        state.flush()
+    changes_queue: "asyncio.Queue[List[Tuple[str, NotebookInfo]]]" = asyncio.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+    # One HTTP/2 client for the whole run: Kaggle and Bark requests reuse pooled connections,
+    # and concurrent Kaggle requests are multiplexed over a single connection
+    async with httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, headers={"User-Agent": USER_AGENT},
+                                 follow_redirects=True) as client:
+        notify_task = asyncio.create_task(notifier(client, bark, changes_queue, args.interval))
+        try:
+            await fetcher(args, client, state, changes_queue)
+        finally:
+            # Deliver whatever is still queued before closing the client, even if the fetcher raised:
+            # its changes are already saved to state and would otherwise never be notified
+            if not notify_task.done():
+                try:
+                    await asyncio.wait_for(changes_queue.join(), NOTIFY_DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # Never wait out a Bark backoff on the way out
+                    log.warning("Gave up waiting for pending notifications after %ss", NOTIFY_DRAIN_TIMEOUT)
+            notify_task.cancel()
+
+
+def main():
+    args = parse_args()
+    # Only the monitor's own logger gets --verbose: httpx logs every request URL at INFO,
+    # which would repeat each poll and leak the Bark key
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(message)s")
+    log.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    try:
+        acquire_state_lock(args.state)
+    except BlockingIOError:
+        log.error("Another monitor is already using state file %s; exiting", args.state)
+        sys.exit(1)
+    except OSError as e:
+        # e.g. NFS/SMB without flock support or an unwritable directory: run unlocked, as on Windows
+        log.warning("Could not lock state file %s (%s); continuing without the lock", args.state, e)
+    load_dotenv()
+    bark = args.bark or os.getenv("BARK_KEY")
+    asyncio.run(monitor_loop(args, bark))
 
 
 if __name__ == "__main__":